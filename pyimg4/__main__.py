@@ -508,13 +508,14 @@ def im4p_info(input_: BinaryIO, verbose: bool) -> None:
 
     click.echo(f'  Encrypted: {im4p.payload.encrypted}')
     if im4p.payload.encrypted:
-        click.echo(f'  Keybags ({len(im4p.payload.keybags)}):')
-        for k, kb in enumerate(im4p.payload.keybags):
+        keybags = im4p.payload.keybags
+        click.echo(f'  Keybags ({len(keybags)}):')
+        for k, kb in enumerate(keybags):
             click.echo(f'    Type: {kb.type.name}')
             click.echo(f'    IV: {kb.iv.hex()}')
             click.echo(f'    Key: {kb.key.hex()}')
 
-            if k != (len(im4p.payload.keybags) - 1):
+            if k != (len(keybags) - 1):
                 click.echo()
 
     if len(im4p.properties) > 0:
@@ -921,13 +922,14 @@ def img4_info(input_: BinaryIO, verbose: bool) -> None:
 
     click.echo(f'    Encrypted: {img4.im4p.payload.encrypted}')
     if img4.im4p.payload.encrypted:
-        click.echo(f'    Keybags ({len(img4.im4p.payload.keybags)}):')
-        for k, kb in enumerate(img4.im4p.payload.keybags):
+        keybags = img4.im4p.payload.keybags
+        click.echo(f'    Keybags ({len(keybags)}):')
+        for k, kb in enumerate(keybags):
             click.echo(f'      Type: {kb.type.name}')
             click.echo(f'      IV: {kb.iv.hex()}')
             click.echo(f'      Key: {kb.key.hex()}')
 
-            if k != (len(img4.im4p.payload.keybags) - 1):
+            if k != (len(keybags) - 1):
                 click.echo()
 
     click.echo('\n  Image4 manifest info:')
@@ -27,9 +27,11 @@ class UnexpectedDataError(_PyIMG4Error, ValueError):
 
 class UnexpectedTagError(_PyIMG4Error, ValueError):
     def __init__(self, tag: Tag, valid: Union[Classes, Numbers]) -> None:
-        try:
-            tag_type = next(t.name for t in Numbers if t.value == tag.nr)
-        except StopIteration:
+        tag_type = None
+        if tag.cls == Classes.Universal:  # Only universal tag numbers are Numbers
+            tag_type = next((t.name for t in Numbers if t.value == tag.nr), None)
+
+        if tag_type is None:
             tag_type = f"{next(t.name for t in Classes if t.value == tag.cls)} {tag.nr if tag.cls == Classes.Private else ''}"
 
         if isinstance(valid, Numbers):
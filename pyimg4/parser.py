@@ -1,6 +1,8 @@
+from bisect import bisect
 from os import getenv
+from struct import Struct
 from sys import platform
-from typing import Any, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 from zlib import adler32
 
 import asn1
@@ -37,12 +39,110 @@ else:
         )
 
 
+_SEQUENCE = asn1.Numbers.Sequence
+_SET = asn1.Numbers.Set
+_INTEGER = asn1.Numbers.Integer
+_IA5STRING = asn1.Numbers.IA5String
+_OCTETSTRING = asn1.Numbers.OctetString
+
+_UNIVERSAL = asn1.Classes.Universal
+_CONTEXT = asn1.Classes.Context
+_PRIVATE = asn1.Classes.Private
+
+_PRIMITIVE = asn1.Types.Primitive
+_CONSTRUCTED = asn1.Types.Constructed
+
+_MANP_TAG = int.from_bytes(b'MANP', 'big')  # Private tag number of the MANP FourCC
+
+_LZSS_MAGIC = b'complzss'
+_LZSS_HEADER = Struct('>8sIIII')  # Magic, adler32, size, compressed size, version
+_LZFSE_MAGIC = b'bvx'  # Shared prefix of every LZFSE block magic
+_LZFSE_V2_MAGIC = b'bvx2'
+_LZFSE_END_MAGIC = b'bvx$'
+
+
+def _has_lzfse_end(data: bytes) -> bool:
+    # The end-of-stream block is written last, so check the (possibly
+    # AES-padded) tail before falling back to scanning the whole payload
+    return _LZFSE_END_MAGIC in data[-64:] or _LZFSE_END_MAGIC in data
+
+
+def _tag_name(tag: asn1.Tag) -> str:
+    # Only universal tags have an asn1.Numbers name
+    if isinstance(tag.nr, asn1.Numbers):
+        return tag.nr.name.upper()
+
+    return f'{tag.cls.name.upper()} {tag.nr}'
+
+
+def _read_der_header(
+    data: bytes, offset: int = 0, end: Optional[int] = None
+) -> Tuple[asn1.Tag, int, int]:
+    # Every read is bounded by end (the end of the parent element, if any), so
+    # truncated data or a child overrunning its parent is caught here
+    if end is None:
+        end = len(data)
+
+    if offset >= end:
+        raise ValueError('Unexpected end of ASN.1 data.')
+
+    byte = data[offset]
+    offset += 1
+
+    nr = byte & 0x1F
+    if nr == 0x1F:  # High tag number form
+        nr = 0
+        while True:
+            if offset >= end:
+                raise ValueError('Unexpected end of ASN.1 data.')
+
+            nr_byte = data[offset]
+            offset += 1
+
+            nr = (nr << 7) | (nr_byte & 0x7F)
+            if not nr_byte & 0x80:
+                break
+
+    if offset >= end:
+        raise ValueError('Unexpected end of ASN.1 data.')
+
+    length = data[offset]
+    offset += 1
+
+    if length == 0x80:
+        raise ValueError('Indefinite length ASN.1 data is not valid DER.')
+
+    if length & 0x80:  # Long form length
+        count = length & 0x7F
+        if offset + count > end:
+            raise ValueError('Unexpected end of ASN.1 data.')
+
+        length = int.from_bytes(data[offset : offset + count], 'big')
+        offset += count
+
+    if offset + length > end:
+        raise ValueError('Unexpected end of ASN.1 data.')
+
+    # Like asn1.Decoder, only universal tag numbers are mapped to asn1.Numbers
+    cls = asn1.Classes(byte & 0xC0)
+    if cls == _UNIVERSAL:
+        try:
+            nr = asn1.Numbers(nr)
+        except ValueError:
+            pass
+
+    tag = asn1.Tag(nr, asn1.Types(byte & 0x20), cls)
+    return tag, offset, offset + length
+
+
 class _PyIMG4:
+    __slots__ = ('__decoder', '__encoder', '_data')
+
     def __init__(self, data: Optional[bytes] = None) -> None:
         self._data = data
 
-        self._decoder = asn1.Decoder()
-        self._encoder = asn1.Encoder()
+        self.__decoder: Optional[asn1.Decoder] = None
+        self.__encoder: Optional[asn1.Encoder] = None
 
     def __bytes__(self) -> bytes:
         return self.output()
@@ -58,14 +158,32 @@ class _PyIMG4:
     def __len__(self) -> int:
         return len(self.output())
 
+    @property
+    def _decoder(self) -> asn1.Decoder:
+        # Objects read from a parent's decoder (e.g. every manifest property)
+        # never decode anything themselves, so only create a decoder once needed
+        if self.__decoder is None:
+            self.__decoder = asn1.Decoder()
+
+        return self.__decoder
+
+    @property
+    def _encoder(self) -> asn1.Encoder:
+        # Parsed objects (e.g. every manifest property) are often only read,
+        # so only create an encoder once one is needed
+        if self.__encoder is None:
+            self.__encoder = asn1.Encoder()
+
+        return self.__encoder
+
     def _verify_fourcc(self, fourcc: str, correct: str = None) -> str:
         if not isinstance(fourcc, str):
             raise UnexpectedDataError('string', fourcc)
 
         if correct is not None:
-            self._verify_fourcc(correct)
-
-            if fourcc.casefold() == correct.casefold():
+            # correct is always one of our own FourCC constants, so it doesn't
+            # need to be verified, and an exact match skips casefolding
+            if fourcc == correct or fourcc.casefold() == correct.casefold():
                 return fourcc
             else:
                 raise UnexpectedDataError(correct, fourcc)
@@ -75,11 +193,60 @@ class _PyIMG4:
 
         return fourcc
 
+    @staticmethod
+    def _verify_tag(
+        tag: asn1.Tag,
+        nr: Optional[asn1.Numbers] = None,
+        cls: Optional[asn1.Classes] = None,
+    ) -> asn1.Tag:
+        if nr is not None and tag.nr != nr:
+            raise UnexpectedTagError(tag, nr)
+
+        if cls is not None and tag.cls != cls:
+            raise UnexpectedTagError(tag, cls)
+
+        return tag
+
+    def _expect_tag(
+        self,
+        nr: Optional[asn1.Numbers] = None,
+        cls: Optional[asn1.Classes] = None,
+    ) -> asn1.Tag:
+        return self._verify_tag(self._decoder.peek(), nr, cls)
+
+    def _expect_der(
+        self,
+        offset: int,
+        nr: Optional[asn1.Numbers] = None,
+        cls: Optional[asn1.Classes] = None,
+        end: Optional[int] = None,
+    ) -> Tuple[int, int]:
+        tag, start, end = _read_der_header(self._data, offset, end)
+        self._verify_tag(tag, nr, cls)
+
+        return start, end
+
+    def _output_group(self, fourcc: str, content: bytes) -> bytes:
+        self._encoder.start()
+        with self._encoder.construct(
+            int.from_bytes(fourcc.encode('ascii'), 'big'), _PRIVATE
+        ):
+            with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+                self._encoder.write(fourcc, _IA5STRING, _PRIMITIVE, _UNIVERSAL)
+
+                # Each entry's output is already wrapped in its private tag,
+                # so it can be written into the Set as-is
+                self._encoder.write(content, _SET, _CONSTRUCTED, _UNIVERSAL)
+
+        return self._encoder.output()
+
     def output(self) -> bytes:
         return self._data
 
 
 class _Property(_PyIMG4):
+    __slots__ = ('_fourcc', '_output', '_value')
+
     def __init__(
         self,
         data: Optional[bytes] = None,
@@ -89,7 +256,9 @@ class _Property(_PyIMG4):
     ) -> None:
         super().__init__(data)
 
-        if fourcc and value:
+        self._output: Optional[bytes] = None
+
+        if fourcc is not None and value is not None:
             self._fourcc = self._verify_fourcc(fourcc)
             self._value = value
 
@@ -112,13 +281,31 @@ class _Property(_PyIMG4):
     def _parse(self) -> None:
         self._decoder.start(self._data)
 
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+        self._expect_tag(_SEQUENCE)
 
         self._decoder.enter()
         self._fourcc = self._verify_fourcc(self._decoder.read()[1])
         self._value = self._decoder.read()[1]
 
+    @classmethod
+    def _from_decoder(cls, decoder: asn1.Decoder) -> '_Property':
+        # Read the property from its parent's decoder, rather than re-decoding
+        # the property's own data with a new decoder
+        cls._verify_tag(decoder.peek(), _SEQUENCE)
+
+        # Properties can have a NULL (None) value, which __init__ treats as no
+        # value being provided, so set the parsed fields directly
+        prop = cls.__new__(cls)
+        _PyIMG4.__init__(prop)
+        prop._output = None
+
+        decoder.enter()
+        prop._fourcc = prop._verify_fourcc(decoder.read()[1])
+        prop._value = decoder.read()[1]
+        decoder.leave()
+
+        return prop
+
     @property
     def fourcc(self) -> str:
         return self._fourcc
@@ -128,26 +315,26 @@ class _Property(_PyIMG4):
         return self._value
 
     def output(self) -> bytes:
+        # Properties can't be modified, so they only ever need to be encoded once
+        if self._output is not None:
+            return self._output
+
         self._encoder.start()
         with self._encoder.construct(
-            int(bytes(self.fourcc, 'ascii').hex(), 16), asn1.Classes.Private
+            int.from_bytes(self.fourcc.encode('ascii'), 'big'), _PRIVATE
         ):
-            with self._encoder.construct(asn1.Numbers.Sequence, asn1.Classes.Universal):
-                self._encoder.write(
-                    self.fourcc,
-                    asn1.Numbers.IA5String,
-                    asn1.Types.Primitive,
-                    asn1.Classes.Universal,
-                )
+            with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+                self._encoder.write(self.fourcc, _IA5STRING, _PRIMITIVE, _UNIVERSAL)
 
-                self._encoder.write(
-                    self.value, None, asn1.Types.Primitive, asn1.Classes.Universal
-                )
+                self._encoder.write(self.value, None, _PRIMITIVE, _UNIVERSAL)
 
-        return self._encoder.output()
+        self._output = self._encoder.output()
+        return self._output
 
 
 class _PropertyGroup(_PyIMG4):
+    __slots__ = ('_fourcc', '_properties')
+
     _property = _Property
 
     def __init__(
@@ -155,7 +342,7 @@ class _PropertyGroup(_PyIMG4):
     ) -> None:
         super().__init__(data)
 
-        self._properties: List[Optional[self._property]] = []
+        self._properties: Dict[str, self._property] = {}
 
         if data:
             self._parse()
@@ -172,20 +359,48 @@ class _PropertyGroup(_PyIMG4):
     def _parse(self) -> None:
         self._decoder.start(self._data)
 
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+        self._expect_tag(_SEQUENCE)
 
         self._decoder.enter()
 
         self._fourcc = self._verify_fourcc(self._decoder.read()[1])
+        self._parse_properties(self._decoder)
 
-        if self._decoder.peek().nr != asn1.Numbers.Set:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Set)
+    def _parse_properties(self, decoder: asn1.Decoder) -> None:
+        self._verify_tag(decoder.peek(), _SET)
 
-        self._decoder.enter()
+        decoder.enter()
+
+        eof, enter, leave = decoder.eof, decoder.enter, decoder.leave
+        from_decoder = self._property._from_decoder
+        properties = self._properties
+        while not eof():
+            enter()
+            prop = from_decoder(decoder)
+            if prop.fourcc in properties:
+                raise ValueError(f'Property "{prop.fourcc}" already exists.')
+
+            properties[prop.fourcc] = prop
+            leave()
+
+        leave()
+
+    @classmethod
+    def _from_decoder(cls, decoder: asn1.Decoder) -> '_PropertyGroup':
+        # Read the group from its parent's decoder, rather than re-decoding
+        # the group's own data with a new decoder
+        cls._verify_tag(decoder.peek(), _SEQUENCE)
+
+        decoder.enter()
+        group = cls(fourcc=decoder.read()[1])
+        group._parse_properties(decoder)
+        decoder.leave()
 
-        while not self._decoder.eof():
-            self._properties.append(self._property(self._decoder.read()[1]))
+        return group
+
+    def _property_value(self, fourcc: str) -> Any:
+        prop = self._properties.get(fourcc)
+        return prop.value if prop is not None else None
 
     @property
     def fourcc(self) -> str:
@@ -193,16 +408,16 @@ class _PropertyGroup(_PyIMG4):
 
     @property
     def properties(self) -> Tuple[Optional[_property]]:
-        return tuple(self._properties)
+        return tuple(self._properties.values())
 
     def add_property(self, prop: _property) -> None:
         if not isinstance(prop, self._property):
             raise UnexpectedDataError(self._property.__name__, prop)
 
-        if any(p.fourcc == prop.fourcc for p in self.properties):
+        if prop.fourcc in self._properties:
             raise ValueError(f'Property "{prop.fourcc}" already exists.')
 
-        self._properties.append(prop)
+        self._properties[prop.fourcc] = prop
 
     def remove_property(
         self, prop: Optional[_property] = None, fourcc: Optional[str] = None
@@ -211,22 +426,19 @@ class _PropertyGroup(_PyIMG4):
             if not isinstance(prop, self._property):
                 raise UnexpectedDataError(self._property.__name__, prop)
 
-            if prop not in self.properties:
+            if self._properties.get(prop.fourcc) != prop:
                 raise ValueError(f'Property "{prop.fourcc}" is not set')
 
-            self._properties.remove(prop)
+            del self._properties[prop.fourcc]
 
         elif fourcc is not None:
             self._verify_fourcc(fourcc)
 
-            prop = next(
-                (prop for prop in self.properties if prop.fourcc == fourcc), None
-            )
-            if prop is not None:
-                self._properties.remove(prop)
-            else:
+            if fourcc not in self._properties:
                 raise ValueError(f'Property "{fourcc}" is not set')
 
+            del self._properties[fourcc]
+
         else:
             raise TypeError(f'No {self._property.__name__} or fourcc provided.')
 
@@ -234,76 +446,46 @@ class _PropertyGroup(_PyIMG4):
         if len(self.properties) == 0:
             raise ValueError('No properties are set')
 
-        self._encoder.start()
-        with self._encoder.construct(
-            int(bytes(self.fourcc, 'ascii').hex(), 16), asn1.Classes.Private
-        ):
-            with self._encoder.construct(asn1.Numbers.Sequence, asn1.Classes.Universal):
-                self._encoder.write(
-                    self.fourcc,
-                    asn1.Numbers.IA5String,
-                    asn1.Types.Primitive,
-                    asn1.Classes.Universal,
-                )
-
-                with self._encoder.construct(asn1.Numbers.Set, asn1.Classes.Universal):
-                    for prop in self.properties:
-                        self._decoder.start(prop.output())
-                        with self._encoder.construct(
-                            self._decoder.peek().nr, asn1.Classes.Private
-                        ):
-                            self._decoder.enter()
-                            self._encoder.write(
-                                self._decoder.read()[1],
-                                asn1.Numbers.Sequence,
-                                asn1.Types.Constructed,
-                                asn1.Classes.Universal,
-                            )
-
-        return self._encoder.output()
+        return self._output_group(
+            self.fourcc, b''.join(prop.output() for prop in self.properties)
+        )
 
 
 class Data(_PyIMG4):
-    def get_type(self) -> Optional[Union['IMG4', 'IM4P', 'IM4M', 'IM4R']]:
-        self._decoder.start(self._data)
-
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+    __slots__ = ()
 
-        self._decoder.enter()
+    def get_type(self) -> Optional[Union['IMG4', 'IM4P', 'IM4M', 'IM4R']]:
+        # Only the outer FourCC is needed, so read it straight from the data
+        # instead of having the decoder copy out the entire Sequence
+        offset, end = self._expect_der(0, _SEQUENCE)
+        start, end = self._expect_der(offset, _IA5STRING, end=end)
 
-        fourcc = self._verify_fourcc(self._decoder.read()[1])
-        if fourcc == 'IMG4':
-            return IMG4
-        elif fourcc == 'IM4P':
-            return IM4P
-        elif fourcc == 'IM4M':
-            return IM4M
-        elif fourcc == 'IM4R':
-            return IM4R
+        fourcc = self._verify_fourcc(str(self._data[start:end], 'ascii'))
+        return _TYPES.get(fourcc)
 
 
 class ManifestProperty(_Property):
-    pass
+    __slots__ = ()
 
 
 class ManifestImageProperties(_PropertyGroup):
+    __slots__ = ()
+
     _property = ManifestProperty
 
     @property
     def digest(self) -> Optional[bytes]:
-        return next(
-            (prop.value for prop in self.properties if prop.fourcc == 'DGST'),
-            None,
-        )
+        return self._property_value('DGST')
 
 
 class IM4M(_PyIMG4):
+    __slots__ = ('_certificates', '_images', '_properties', '_signature')
+
     def __init__(self, data: Optional[bytes] = None) -> None:
         super().__init__(data)
 
-        self._images: List[ManifestImageProperties] = []
-        self._properties: List[ManifestProperty] = []
+        self._images: Dict[str, Union[bytes, ManifestImageProperties]] = {}
+        self._properties: Dict[str, ManifestProperty] = {}
 
         if data:
             self._parse()
@@ -311,7 +493,7 @@ class IM4M(_PyIMG4):
     def __repr__(self) -> str:
         repr_ = 'IM4M('
         for p in ('CHIP', 'ECID'):
-            prop = next((prop for prop in self.properties if prop.fourcc == p), None)
+            prop = self._properties.get(p)
 
             if prop is not None:
                 repr_ += f'{prop.fourcc}={prop.value}, '
@@ -319,69 +501,81 @@ class IM4M(_PyIMG4):
         return f'{repr_[:-2]})' if ',' in repr_ else f'{repr_})'
 
     def _parse(self) -> None:
-        self._decoder.start(self._data)
+        decoder = self._decoder
+        eof, peek, read = decoder.eof, decoder.peek, decoder.read
+        enter, leave = decoder.enter, decoder.leave
 
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+        decoder.start(self._data)
 
-        self._decoder.enter()
-        self._verify_fourcc(self._decoder.read()[1], 'IM4M')
+        self._verify_tag(peek(), _SEQUENCE)
 
-        if self._decoder.read()[0].nr != asn1.Numbers.Integer:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Integer)
+        enter()
+        self._verify_fourcc(read()[1], 'IM4M')
 
-        if self._decoder.peek().nr != asn1.Numbers.Set:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Set)
+        self._verify_tag(peek(), _INTEGER)
+        read()
 
-        self._decoder.enter()
+        self._verify_tag(peek(), _SET)
 
-        if self._decoder.peek().cls != asn1.Classes.Private:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Classes.Private)
+        enter()
 
-        self._decoder.enter()
+        self._verify_tag(peek(), cls=_PRIVATE)
 
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+        enter()
 
-        self._decoder.enter()
-        self._verify_fourcc(
-            self._decoder.read()[1], 'MANB'
-        )  # Verify MANB (Manifest Body) FourCC
+        self._verify_tag(peek(), _SEQUENCE)
 
-        if self._decoder.peek().nr != asn1.Numbers.Set:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Set)
+        enter()
+        self._verify_fourcc(read()[1], 'MANB')  # Verify MANB (Manifest Body) FourCC
 
-        self._decoder.enter()
-        while not self._decoder.eof():
-            data = ManifestImageProperties(self._decoder.read()[1])
-            if data.fourcc == 'MANP':
-                self._properties = list(data.properties)
+        self._verify_tag(peek(), _SET)
+
+        enter()
+
+        images = self._images
+        manp = None
+        while not eof():
+            if peek().nr == _MANP_TAG:
+                if manp is not None:
+                    raise ValueError('Manifest properties already exist.')
+
+                enter()
+                manp = ManifestImageProperties._from_decoder(decoder)
+                leave()
+
+                self._properties = manp._properties
             else:
-                self._images.append(data)
+                # Most callers never look at the image properties, so only
+                # keep their data until they're accessed
+                tag, image = read()
+                fourcc = tag.nr.to_bytes(4, 'big').decode('ascii')
+                if fourcc in images:
+                    raise ValueError(f'Properties for image "{fourcc}" already exist.')
+
+                images[fourcc] = image
 
-        for _ in range(4):
-            self._decoder.leave()
+        for _ in range(4):  # MANB Set, MANB Sequence, MANB tag, manifest Set
+            leave()
 
-        self._signature = self._decoder.read()[1]
-        self._certificates = self._decoder.read()[1]
+        self._signature = read()[1]
+        self._certificates = read()[1]
 
-        if not self._decoder.eof():
+        if not eof():
             raise ValueError(
-                f'Unexpected data found at end of Image4 manifest: {self._decoder.peek().nr.name.upper()}'
+                f'Unexpected data found at end of Image4 manifest: {_tag_name(peek())}'
             )
 
+    def _property_value(self, fourcc: str) -> Any:
+        prop = self._properties.get(fourcc)
+        return prop.value if prop is not None else None
+
     @property
     def apnonce(self) -> Optional[bytes]:
-        return next(
-            (prop.value for prop in self.properties if prop.fourcc == 'BNCH'),
-            None,
-        )
+        return self._property_value('BNCH')
 
     @property
     def board_id(self) -> Optional[int]:
-        return next(
-            (prop.value for prop in self.properties if prop.fourcc == 'BORD'), None
-        )
+        return self._property_value('BORD')
 
     @property
     def certificates(self) -> bytes:
@@ -389,30 +583,28 @@ class IM4M(_PyIMG4):
 
     @property
     def chip_id(self) -> Optional[int]:
-        return next(
-            (prop.value for prop in self.properties if prop.fourcc == 'CHIP'), None
-        )
+        return self._property_value('CHIP')
 
     @property
     def ecid(self) -> Optional[int]:
-        return next(
-            (prop.value for prop in self.properties if prop.fourcc == 'ECID'), None
-        )
+        return self._property_value('ECID')
 
     @property
     def images(self) -> Tuple[Optional[ManifestImageProperties]]:
-        return tuple(self._images)
+        images = self._images
+        for fourcc, image in images.items():
+            if isinstance(image, bytes):
+                images[fourcc] = ManifestImageProperties(image)
+
+        return tuple(images.values())
 
     @property
     def properties(self) -> Tuple[Optional[ManifestProperty]]:
-        return tuple(self._properties)
+        return tuple(self._properties.values())
 
     @property
     def sepnonce(self) -> Optional[bytes]:
-        return next(
-            (prop.value for prop in self.properties if prop.fourcc == 'snon'),
-            None,
-        )
+        return self._property_value('snon')
 
     @property
     def signature(self) -> bytes:
@@ -424,13 +616,31 @@ class IM4M(_PyIMG4):
                 ManifestImageProperties.__name__, image_properties
             )
 
-        if any(image.fourcc == image_properties.fourcc for image in self.images):
+        if image_properties.fourcc in self._images:
             raise ValueError(
                 f'Properties for image "{image_properties.fourcc}" already exist.'
             )
 
-        self._images.append(image_properties)
-        self._images.sort()
+        # DER requires the entries of a Set to be sorted, so keep images
+        # sorted by FourCC, only rebuilding the dict when inserting before the end
+        fourccs = list(self._images)
+        index = bisect(fourccs, image_properties.fourcc)
+        if index == len(fourccs):
+            self._images[image_properties.fourcc] = image_properties
+        else:
+            images = list(self._images.items())
+            images.insert(index, (image_properties.fourcc, image_properties))
+            self._images = dict(images)
+
+    def get_image_properties(self, fourcc: str) -> Optional[ManifestImageProperties]:
+        self._verify_fourcc(fourcc)
+
+        # Only parse the requested image's properties, rather than every image's
+        image = self._images.get(fourcc)
+        if isinstance(image, bytes):
+            image = self._images[fourcc] = ManifestImageProperties(image)
+
+        return image
 
     def remove_image_properties(
         self,
@@ -443,25 +653,20 @@ class IM4M(_PyIMG4):
                     ManifestImageProperties.__name__, image_properties
                 )
 
-            if image_properties not in self.images:
+            if self.get_image_properties(image_properties.fourcc) != image_properties:
                 raise ValueError(
                     f'Properties for image "{image_properties.fourcc}" are not set'
                 )
 
-            self._images.remove(image_properties)
-            self._images.sort()
+            del self._images[image_properties.fourcc]
 
         elif fourcc is not None:
             self._verify_fourcc(fourcc)
 
-            image_properties = next(
-                (image for image in self.images if image.fourcc == fourcc), None
-            )
-            if image_properties is None:
+            if fourcc not in self._images:
                 raise ValueError(f'Properties for image "{fourcc}" are not set')
 
-            self._images.remove(image_properties)
-            self._images.sort()
+            del self._images[fourcc]
         else:
             raise TypeError('No ManifestImageProperties or fourcc provided.')
 
@@ -469,10 +674,10 @@ class IM4M(_PyIMG4):
         if not isinstance(prop, ManifestProperty):
             raise UnexpectedDataError(ManifestProperty.__name__, prop)
 
-        if any(p.fourcc == prop.fourcc for p in self.properties):
+        if prop.fourcc in self._properties:
             raise ValueError(f'Property "{prop.fourcc}" already exists.')
 
-        self._properties.append(prop)
+        self._properties[prop.fourcc] = prop
 
     def remove_property(
         self, prop: Optional[ManifestProperty] = None, fourcc: Optional[str] = None
@@ -481,22 +686,19 @@ class IM4M(_PyIMG4):
             if not isinstance(prop, ManifestProperty):
                 raise UnexpectedDataError(ManifestProperty.__name__, prop)
 
-            if prop not in self.properties:
+            if self._properties.get(prop.fourcc) != prop:
                 raise ValueError(f'Property "{prop.fourcc}" is not set')
 
-            self._properties.remove(prop)
+            del self._properties[prop.fourcc]
 
         elif fourcc is not None:
             self._verify_fourcc(fourcc)
 
-            prop = next(
-                (prop for prop in self.properties if prop.fourcc == fourcc), None
-            )
-            if prop is not None:
-                self._properties.remove(prop)
-            else:
+            if fourcc not in self._properties:
                 raise ValueError(f'Property "{fourcc}" is not set')
 
+            del self._properties[fourcc]
+
         else:
             raise TypeError('No ManifestProperty or fourcc provided.')
 
@@ -504,82 +706,70 @@ class IM4M(_PyIMG4):
         if len(self.properties) == 0:
             raise ValueError('No properties are set')
 
-        if len(self.images) == 0:
+        if len(self._images) == 0:
             raise ValueError('No images are set')
 
-        self._encoder.start()
-        with self._encoder.construct(asn1.Numbers.Sequence, asn1.Classes.Universal):
-            self._encoder.write(
-                'IM4M',
-                asn1.Numbers.IA5String,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
+        manb = [
+            self._output_group(
+                'MANP', b''.join(prop.output() for prop in self.properties)
             )
+        ]
+        for fourcc, image in self._images.items():
+            if isinstance(image, bytes):
+                # Images that were never accessed are still raw, so wrap them
+                # back up as-is instead of parsing them just to re-encode them
+                self._encoder.start()
+                self._encoder.write(
+                    image,
+                    int.from_bytes(fourcc.encode('ascii'), 'big'),
+                    _CONSTRUCTED,
+                    _PRIVATE,
+                )
+                manb.append(self._encoder.output())
+            else:
+                manb.append(image.output())
 
-            self._encoder.write(
-                0,
-                asn1.Numbers.Integer,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
-            )
+        manb = self._output_group('MANB', b''.join(manb))
 
-            with self._encoder.construct(asn1.Numbers.Set, asn1.Classes.Universal):
-                manp = ManifestImageProperties(fourcc='MANP')
-                for prop in self.properties:
-                    manp.add_property(prop)
+        self._encoder.start()
+        with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+            self._encoder.write('IM4M', _IA5STRING, _PRIMITIVE, _UNIVERSAL)
 
-                manb = ManifestImageProperties(fourcc='MANB')
-                manb._properties = [manp, *self.images]
-                self._decoder.start(manb.output())
-                with self._encoder.construct(
-                    self._decoder.peek().nr, asn1.Classes.Private
-                ):
-                    self._decoder.enter()
-                    self._encoder.write(
-                        self._decoder.read()[1],
-                        asn1.Numbers.Sequence,
-                        asn1.Types.Constructed,
-                        asn1.Classes.Universal,
-                    )
+            self._encoder.write(0, _INTEGER, _PRIMITIVE, _UNIVERSAL)
 
-            self._encoder.write(
-                self.signature,
-                asn1.Numbers.OctetString,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
-            )
+            self._encoder.write(manb, _SET, _CONSTRUCTED, _UNIVERSAL)
 
-            self._encoder.write(
-                self.certificates,
-                asn1.Numbers.Sequence,
-                asn1.Types.Constructed,
-                asn1.Classes.Universal,
-            )
+            self._encoder.write(self.signature, _OCTETSTRING, _PRIMITIVE, _UNIVERSAL)
+
+            self._encoder.write(self.certificates, _SEQUENCE, _CONSTRUCTED, _UNIVERSAL)
         return self._encoder.output()
 
 
 class RestoreProperty(_Property):
-    pass
+    __slots__ = ()
 
 
 class IM4R(_PropertyGroup):
+    __slots__ = ()
+
     _property = RestoreProperty
 
     def __init__(self, data: Optional[bytes] = None) -> None:
         super().__init__(data, fourcc='IM4R')
 
-        if self.boot_nonce is not None:
-            self.boot_nonce = self.boot_nonce[::-1]
+        # The boot nonce is stored reversed in the IM4R itself
+        prop = self._properties.get('BNCN')
+        if prop is not None:
+            self._properties['BNCN'] = RestoreProperty(
+                fourcc='BNCN', value=prop.value[::-1]
+            )
 
     def __repr__(self) -> str:
         return f'IM4R(properties={len(self.properties)})'
 
     @property
     def boot_nonce(self) -> Optional[bytes]:
-        return next(
-            (prop.value for prop in self.properties if prop.fourcc == 'BNCN'),
-            None,
-        )
+        return self._property_value('BNCN')
 
     @boot_nonce.setter
     def boot_nonce(self, boot_nonce: bytes) -> None:
@@ -589,46 +779,37 @@ class IM4R(_PropertyGroup):
         if len(boot_nonce) != 8:
             raise UnexpectedDataError('bytes with length of 8', boot_nonce)
 
-        prop = next((p for p in self.properties if p.fourcc == 'BNCN'), None)
-        if prop is not None:
-            self.remove_property(prop)
-
-        self.add_property(RestoreProperty(fourcc='BNCN', value=boot_nonce))
+        self._properties['BNCN'] = RestoreProperty(fourcc='BNCN', value=boot_nonce)
 
     def output(self) -> bytes:
         if len(self.properties) == 0:
             raise ValueError('No properties are set')
 
         self._encoder.start()
-        with self._encoder.construct(asn1.Numbers.Sequence, asn1.Classes.Universal):
-            self._encoder.write(
-                self.fourcc,
-                asn1.Numbers.IA5String,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
-            )
+        with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+            self._encoder.write(self.fourcc, _IA5STRING, _PRIMITIVE, _UNIVERSAL)
 
-            with self._encoder.construct(asn1.Numbers.Set, asn1.Classes.Universal):
-                if self.boot_nonce is not None:
-                    self.boot_nonce = self.boot_nonce[::-1]
+            properties = self._properties
+            prop = properties.get('BNCN')
+            if prop is not None:
+                properties = {
+                    **properties,
+                    'BNCN': RestoreProperty(fourcc='BNCN', value=prop.value[::-1]),
+                }
 
-                for prop in self.properties:
-                    self._decoder.start(prop.output())
-                    with self._encoder.construct(
-                        self._decoder.peek().nr, asn1.Classes.Private
-                    ):
-                        self._decoder.enter()
-                        self._encoder.write(
-                            self._decoder.read()[1],
-                            asn1.Numbers.Sequence,
-                            asn1.Types.Constructed,
-                            asn1.Classes.Universal,
-                        )
+            self._encoder.write(
+                b''.join(prop.output() for prop in properties.values()),
+                _SET,
+                _CONSTRUCTED,
+                _UNIVERSAL,
+            )
 
         return self._encoder.output()
 
 
 class IMG4(_PyIMG4):
+    __slots__ = ('_im4m', '_im4p', '_im4r')
+
     def __init__(
         self,
         data: Optional[bytes] = None,
@@ -641,6 +822,10 @@ class IMG4(_PyIMG4):
 
         if data:
             self._parse()
+
+            # The parsed IM4P/IM4M/IM4R hold everything output() needs, so
+            # don't keep a second copy of the (payload-sized) raw data alive
+            self._data = None
         else:
             self.im4p = im4p
             self.im4m = im4m
@@ -653,42 +838,30 @@ class IMG4(_PyIMG4):
             return 'IMG4()'
 
     def _parse(self) -> None:
-        self._decoder.start(self._data)
-        self._encoder.start()
-
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
-
-        self._decoder.enter()
-        self._verify_fourcc(self._decoder.read()[1], 'IMG4')  # Verify IMG4 FourCC
-
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+        # Slice the IM4P/IM4M/IM4R out of the original buffer instead of
+        # decoding them and re-encoding them for their own parsers.
+        offset, end = self._expect_der(0, _SEQUENCE)
 
-        self._encoder.write(
-            self._decoder.read()[1],
-            asn1.Numbers.Sequence,
-            asn1.Types.Constructed,
-            asn1.Classes.Universal,
-        )
-        self.im4p = IM4P(self._encoder.output())  # IM4P
+        start, offset = self._expect_der(offset, _IA5STRING, end=end)
+        self._verify_fourcc(
+            self._data[start:offset].decode('ascii'), 'IMG4'
+        )  # Verify IMG4 FourCC
 
-        if self._decoder.peek().cls != asn1.Classes.Context:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Classes.Context)
+        _, im4p_end = self._expect_der(offset, _SEQUENCE, end=end)
+        self.im4p = IM4P(memoryview(self._data)[offset:im4p_end])  # IM4P
 
-        self.im4m = IM4M(self._decoder.read()[1])  # IM4M
+        start, offset = self._expect_der(im4p_end, cls=_CONTEXT, end=end)
+        self.im4m = IM4M(self._data[start:offset])  # IM4M
 
-        if self._decoder.eof():
+        if offset == end:
             self.im4r = None
-
-        elif self._decoder.peek().cls != asn1.Classes.Context:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Classes.Context)
-
         else:
-            self.im4r = IM4R(self._decoder.read()[1])  # IM4R
-        if not self._decoder.eof():
+            start, offset = self._expect_der(offset, cls=_CONTEXT, end=end)
+            self.im4r = IM4R(self._data[start:offset])  # IM4R
+
+        if offset != end:
             raise ValueError(
-                f'Unexpected data found at end of Image4: {self._decoder.peek().nr.name.upper()}'
+                f'Unexpected data found at end of Image4: {_tag_name(_read_der_header(self._data, offset, end)[0])}'
             )
 
     @property
@@ -727,13 +900,8 @@ class IMG4(_PyIMG4):
     def output(self) -> bytes:
         self._encoder.start()
 
-        with self._encoder.construct(asn1.Numbers.Sequence, asn1.Classes.Universal):
-            self._encoder.write(
-                'IMG4',
-                asn1.Numbers.IA5String,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
-            )
+        with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+            self._encoder.write('IMG4', _IA5STRING, _PRIMITIVE, _UNIVERSAL)
 
             if self.im4p is None:
                 raise ValueError('No IM4P is set.')
@@ -741,37 +909,29 @@ class IMG4(_PyIMG4):
             self._decoder.start(self.im4p.output())
             self._encoder.write(
                 self._decoder.read()[1],
-                asn1.Numbers.Sequence,
-                asn1.Types.Constructed,
-                asn1.Classes.Universal,
+                _SEQUENCE,
+                _CONSTRUCTED,
+                _UNIVERSAL,
             )
 
             if self.im4m is None:
                 raise ValueError('No IM4M is set.')
 
-            self._encoder.write(
-                self.im4m.output(),
-                0,
-                asn1.Types.Constructed,
-                asn1.Classes.Context,
-            )
+            self._encoder.write(self.im4m.output(), 0, _CONSTRUCTED, _CONTEXT)
 
             if self.im4r is not None:
-                self._encoder.write(
-                    self.im4r.output(),
-                    1,
-                    asn1.Types.Constructed,
-                    asn1.Classes.Context,
-                )
+                self._encoder.write(self.im4r.output(), 1, _CONSTRUCTED, _CONTEXT)
 
         return self._encoder.output()
 
 
 class PayloadProperty(_Property):
-    pass
+    __slots__ = ()
 
 
 class IM4P(_PyIMG4):
+    __slots__ = ('_description', '_fourcc', '_payload', '_properties')
+
     def __init__(
         self,
         data: Optional[bytes] = None,
@@ -782,10 +942,14 @@ class IM4P(_PyIMG4):
     ) -> None:
         super().__init__(data)
 
-        self._properties = []
+        self._properties: Dict[str, PayloadProperty] = {}
 
         if data:
             self._parse()
+
+            # The payload keeps its own copy of the data, so don't keep a
+            # second copy alive through the raw IM4P
+            self._data = None
         else:
             self.fourcc = fourcc
             self.description = description
@@ -805,81 +969,106 @@ class IM4P(_PyIMG4):
         return f'IM4P(fourcc={self.fourcc}, description="{self.description}")'
 
     def _parse(self) -> None:
-        self._decoder.start(self._data)
+        # Walk the IM4P through a memoryview, so the payload is only copied
+        # once, when it's handed to IM4PData
+        self._data = memoryview(self._data)
 
-        if self._decoder.peek().nr != asn1.Numbers.Sequence:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+        offset, end = self._expect_der(0, _SEQUENCE)
 
-        self._decoder.enter()
+        start, offset = self._expect_der(offset, _IA5STRING, end=end)
         self._verify_fourcc(
-            self._decoder.read()[1], 'IM4P'
+            str(self._data[start:offset], 'ascii'), 'IM4P'
         )  # Verify IM4P (IMG4 Payload) FourCC
 
-        if self._decoder.peek().nr != asn1.Numbers.IA5String:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.IA5String)
-
+        start, offset = self._expect_der(offset, _IA5STRING, end=end)
         self.fourcc = self._verify_fourcc(
-            self._decoder.read()[1]
+            str(self._data[start:offset], 'ascii')
         )  # Will raise error if FourCC is invalid
 
-        if self._decoder.peek().nr != asn1.Numbers.IA5String:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.IA5String)
+        start, offset = self._expect_der(offset, _IA5STRING, end=end)
+        self.description = str(self._data[start:offset], 'utf-8')
 
-        self.description = self._decoder.read()[1]
+        start, offset = self._expect_der(offset, _OCTETSTRING, end=end)
+        payload = bytes(self._data[start:offset])
 
-        if self._decoder.peek().nr != asn1.Numbers.OctetString:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.OctetString)
+        keybags = []
+        if offset < end:
+            tag, start, kbag_end = _read_der_header(self._data, offset, end)
+            if tag.nr == _OCTETSTRING:
+                kbag_data = self._data[start:kbag_end]
 
-        self.payload = self._decoder.read()[1]
+                tag, kbag_offset, kbags_end = _read_der_header(kbag_data)
+                self._verify_tag(tag, _SEQUENCE)
 
-        if (
-            not self._decoder.eof()
-            and self._decoder.peek().nr == asn1.Numbers.OctetString
-        ):
-            kbag_decoder = asn1.Decoder()
-            kbag_decoder.start(self._decoder.read()[1])
+                while kbag_offset < kbags_end:
+                    tag, start, kbag_offset = _read_der_header(
+                        kbag_data, kbag_offset, kbags_end
+                    )
+                    self._verify_tag(tag, _SEQUENCE)
 
-            if kbag_decoder.peek().nr != asn1.Numbers.Sequence:
-                raise UnexpectedTagError(kbag_decoder.peek(), asn1.Numbers.Sequence)
+                    keybags.append(Keybag(bytes(kbag_data[start:kbag_offset])))
 
-            kbag_decoder.enter()
+                offset = kbag_end
 
-            while not kbag_decoder.eof():
-                if kbag_decoder.peek().nr != asn1.Numbers.Sequence:
-                    raise UnexpectedTagError(kbag_decoder.peek(), asn1.Numbers.Sequence)
+        size = 0
+        if offset < end:
+            tag, start, size_end = _read_der_header(self._data, offset, end)
+            if tag.nr == _SEQUENCE:
+                tag, start, value_end = _read_der_header(self._data, start, size_end)
+                if (
+                    tag.nr == _INTEGER
+                    and int.from_bytes(self._data[start:value_end], 'big', signed=True)
+                    == 1
+                ):
+                    start, value_end = self._expect_der(value_end, end=size_end)
+                    size = int.from_bytes(
+                        self._data[start:value_end], 'big', signed=True
+                    )
 
-                self.payload.add_keybag(Keybag(kbag_decoder.read()[1]))
+                offset = size_end
 
-        if not self._decoder.eof() and self._decoder.peek().nr == asn1.Numbers.Sequence:
-            self._decoder.enter()
+        # Pass the LZFSE uncompressed size along, so the payload doesn't
+        # have to be decompressed just to find it
+        self.payload = IM4PData(payload, size=size)
+        for kbag in keybags:
+            self.payload.add_keybag(kbag)
 
-            if (
-                self._decoder.peek().nr == asn1.Numbers.Integer
-                and self._decoder.read()[1] == 1
-            ):
-                self.payload.size = self._decoder.read()[1]
+        if self.payload.encrypted:
+            self.payload.size = size  # Re-detect compression with keybags added
+
+        if offset < end:
+            tag, start, payp_end = _read_der_header(self._data, offset, end)
+            if tag.cls == _CONTEXT:
+                decoder = self._decoder
+                eof, peek = decoder.eof, decoder.peek
+                enter, leave = decoder.enter, decoder.leave
 
-            self._decoder.leave()
+                decoder.start(bytes(self._data[start:payp_end]))
 
-        if not self._decoder.eof() and self._decoder.peek().cls == asn1.Classes.Context:
-            self._decoder.enter()
+                self._verify_tag(peek(), _SEQUENCE)
 
-            if self._decoder.peek().nr != asn1.Numbers.Sequence:
-                raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Sequence)
+                enter()
+                self._verify_fourcc(decoder.read()[1], 'PAYP')
 
-            self._decoder.enter()
-            self._verify_fourcc(self._decoder.read()[1], 'PAYP')
+                self._verify_tag(peek(), _SET)
 
-            if self._decoder.peek().nr != asn1.Numbers.Set:
-                raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Set)
+                enter()
 
-            self._decoder.enter()
-            while not self._decoder.eof():
-                self._properties.append(PayloadProperty(self._decoder.read()[1]))
+                properties = self._properties
+                while not eof():
+                    enter()
+                    prop = PayloadProperty._from_decoder(decoder)
+                    if prop.fourcc in properties:
+                        raise ValueError(f'Property "{prop.fourcc}" already exists.')
 
-        if not self._decoder.eof():
+                    properties[prop.fourcc] = prop
+                    leave()
+
+                offset = payp_end
+
+        if offset != end:
             raise ValueError(
-                f'Unexpected data found at end of Image4 payload: {self._decoder.peek().nr.name.upper()}'
+                f'Unexpected data found at end of Image4 payload: {_tag_name(_read_der_header(self._data, offset, end)[0])}'
             )
 
     @property
@@ -920,16 +1109,16 @@ class IM4P(_PyIMG4):
 
     @property
     def properties(self) -> Tuple[Optional[PayloadProperty]]:
-        return tuple(self._properties)
+        return tuple(self._properties.values())
 
     def add_property(self, prop: PayloadProperty) -> None:
         if not isinstance(prop, PayloadProperty):
             raise UnexpectedDataError(PayloadProperty.__name__, prop)
 
-        if any(p.fourcc == prop.fourcc for p in self.properties):
+        if prop.fourcc in self._properties:
             raise ValueError(f'Property "{prop.fourcc}" already exists.')
 
-        self._properties.append(prop)
+        self._properties[prop.fourcc] = prop
 
     def remove_property(
         self, prop: Optional[PayloadProperty] = None, fourcc: Optional[str] = None
@@ -938,47 +1127,31 @@ class IM4P(_PyIMG4):
             if not isinstance(prop, PayloadProperty):
                 raise UnexpectedDataError('PayloadProperty', prop)
 
-            if prop not in self.properties:
+            if self._properties.get(prop.fourcc) != prop:
                 raise ValueError(f'Property "{prop.fourcc}" is not set')
 
+            del self._properties[prop.fourcc]
+
         elif fourcc is not None:
             self._verify_fourcc(fourcc)
 
-            prop = next(
-                (prop for prop in self.properties if prop.fourcc == fourcc), None
-            )
-            if prop is not None:
-                self._properties.remove(prop)
-            else:
+            if fourcc not in self._properties:
                 raise ValueError(f'Property "{fourcc}" not found')
 
+            del self._properties[fourcc]
+
     def output(self) -> bytes:
         self._encoder.start()
 
-        with self._encoder.construct(asn1.Numbers.Sequence, asn1.Classes.Universal):
-            self._encoder.write(
-                'IM4P',
-                asn1.Numbers.IA5String,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
-            )
+        with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+            self._encoder.write('IM4P', _IA5STRING, _PRIMITIVE, _UNIVERSAL)
 
             if self.fourcc is None:
                 raise ValueError('No fourcc is set.')
 
-            self._encoder.write(
-                self.fourcc,
-                asn1.Numbers.IA5String,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
-            )
+            self._encoder.write(self.fourcc, _IA5STRING, _PRIMITIVE, _UNIVERSAL)
 
-            self._encoder.write(
-                self.description,
-                asn1.Numbers.IA5String,
-                asn1.Types.Primitive,
-                asn1.Classes.Universal,
-            )
+            self._encoder.write(self.description, _IA5STRING, _PRIMITIVE, _UNIVERSAL)
 
             if self.payload is None:
                 raise ValueError('No payload is set.')
@@ -987,66 +1160,42 @@ class IM4P(_PyIMG4):
                 if i is None:
                     continue
 
-                self._encoder.write(
-                    i,
-                    asn1.Numbers.OctetString,
-                    asn1.Types.Primitive,
-                    asn1.Classes.Universal,
-                )
+                self._encoder.write(i, _OCTETSTRING, _PRIMITIVE, _UNIVERSAL)
 
             if self.payload.compression in (
                 Compression.LZFSE,
                 Compression.LZFSE_ENCRYPTED,
             ):
-                with self._encoder.construct(
-                    asn1.Numbers.Sequence, asn1.Classes.Universal
-                ):
-                    self._encoder.write(
-                        1,
-                        asn1.Numbers.Integer,
-                        asn1.Types.Primitive,
-                        asn1.Classes.Universal,
-                    )
+                with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+                    self._encoder.write(1, _INTEGER, _PRIMITIVE, _UNIVERSAL)
 
                     self._encoder.write(
                         self.payload.size,
-                        asn1.Numbers.Integer,
-                        asn1.Types.Primitive,
-                        asn1.Classes.Universal,
+                        _INTEGER,
+                        _PRIMITIVE,
+                        _UNIVERSAL,
                     )
 
             if len(self.properties) > 0:
-                with self._encoder.construct(0, asn1.Classes.Context):
-                    with self._encoder.construct(
-                        asn1.Numbers.Sequence, asn1.Classes.Universal
-                    ):
+                with self._encoder.construct(0, _CONTEXT):
+                    with self._encoder.construct(_SEQUENCE, _UNIVERSAL):
+                        self._encoder.write('PAYP', _IA5STRING, _PRIMITIVE, _UNIVERSAL)
+
+                        # Each property's output is already wrapped in its
+                        # private tag, so it can be written into the Set as-is
                         self._encoder.write(
-                            'PAYP',
-                            asn1.Numbers.IA5String,
-                            asn1.Types.Primitive,
-                            asn1.Classes.Universal,
+                            b''.join(prop.output() for prop in self.properties),
+                            _SET,
+                            _CONSTRUCTED,
+                            _UNIVERSAL,
                         )
 
-                        with self._encoder.construct(
-                            asn1.Numbers.Set, asn1.Classes.Universal
-                        ):
-                            for prop in self.properties:
-                                self._decoder.start(prop.output())
-                                with self._encoder.construct(
-                                    self._decoder.peek().nr, asn1.Classes.Private
-                                ):
-                                    self._decoder.enter()
-                                    self._encoder.write(
-                                        self._decoder.read()[1],
-                                        asn1.Numbers.Sequence,
-                                        asn1.Types.Constructed,
-                                        asn1.Classes.Universal,
-                                    )
-
         return self._encoder.output()
 
 
 class Keybag(_PyIMG4):
+    __slots__ = ('_iv', '_key', '_output', '_type')
+
     def __init__(
         self,
         data: Optional[bytes] = None,
@@ -1057,6 +1206,8 @@ class Keybag(_PyIMG4):
     ) -> None:
         super().__init__(data)
 
+        self._output: Optional[bytes] = None
+
         if iv and key:
             self.iv = iv
             self.key = key
@@ -1074,26 +1225,22 @@ class Keybag(_PyIMG4):
         )
 
     def _parse(self) -> None:
-        self._decoder.start(self._data)
-
-        if self._decoder.peek().nr != asn1.Numbers.Integer:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.Integer)
-
-        self.type = KeybagType(self._decoder.read()[1])
-
-        if self._decoder.peek().nr != asn1.Numbers.OctetString:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.OctetString)
-
-        self.iv = self._decoder.read()[1]
+        # A keybag is just three small primitives, so read them directly
+        # instead of starting a decoder
+        start, offset = self._expect_der(0, _INTEGER)
+        self._type = KeybagType(  # KeybagType() already rejects unknown types
+            int.from_bytes(self._data[start:offset], 'big', signed=True)
+        )
 
-        if self._decoder.peek().nr != asn1.Numbers.OctetString:
-            raise UnexpectedTagError(self._decoder.peek(), asn1.Numbers.OctetString)
+        start, offset = self._expect_der(offset, _OCTETSTRING)
+        self.iv = self._data[start:offset]
 
-        self.key = self._decoder.read()[1]
+        start, offset = self._expect_der(offset, _OCTETSTRING)
+        self.key = self._data[start:offset]
 
-        if not self._decoder.eof():
+        if offset != len(self._data):
             raise ValueError(
-                f'Unexpected data found at end of keybag: {self._decoder.peek().nr.name.upper()}'
+                f'Unexpected data found at end of keybag: {_tag_name(_read_der_header(self._data, offset)[0])}'
             )
 
     @property
@@ -1109,6 +1256,7 @@ class Keybag(_PyIMG4):
             raise UnexpectedDataError('bytes with len of 16', iv)
 
         self._iv = iv
+        self._output = None
 
     @property
     def key(self) -> bytes:
@@ -1123,6 +1271,7 @@ class Keybag(_PyIMG4):
             raise UnexpectedDataError('bytes with len of 32', key)
 
         self._key = key
+        self._output = None
 
     @property
     def type(self) -> KeybagType:
@@ -1134,22 +1283,43 @@ class Keybag(_PyIMG4):
             raise UnexpectedDataError('KeybagType', type_)
 
         self._type = type_
+        self._output = None
+
+    def output(self) -> bytes:
+        # Keybags are only re-encoded after one of their fields is changed
+        if self._output is not None:
+            return self._output
+
+        self._encoder.start()
+        self._encoder.write(self.type, _INTEGER, _PRIMITIVE, _UNIVERSAL)
+        self._encoder.write(self.iv, _OCTETSTRING, _PRIMITIVE, _UNIVERSAL)
+        self._encoder.write(self.key, _OCTETSTRING, _PRIMITIVE, _UNIVERSAL)
+
+        self._output = self._encoder.output()
+        return self._output
 
 
 class IM4PData(_PyIMG4):
+    __slots__ = ('_compression', '_extra', '_keybags', '_size')
+
     def __init__(
         self, data: bytes, *, size: int = 0, extra: Optional[bytes] = None
     ) -> None:
         super().__init__(data)
 
-        self._keybags = []
+        self._keybags: List[Keybag] = []
         self.extra = extra
 
         self._detect_compression(size, data)
         if self.compression == Compression.LZSS:
             self._parse_complzss_header()
+            if size > 0:  # The IM4P's size takes precedence over the header's
+                self.size = size
         elif self.compression == Compression.LZFSE:
-            self.size = len(self._decompress_data(data, self.compression, size))
+            if size > 0:
+                self.size = size
+            else:  # The size is only known once decompressed
+                self.size = len(self._decompress_data(data, self.compression))
         else:
             self.size = size
 
@@ -1164,14 +1334,9 @@ class IM4PData(_PyIMG4):
         return f'{repr_})'
 
     def _create_complzss_header(self, comp_size: int) -> bytes:
-        header = bytearray(b'complzss')
-        header += adler32(self.data).to_bytes(4, 'big')
-        header += self.size.to_bytes(4, 'big')
-        header += comp_size.to_bytes(4, 'big')
-        header += int(1).to_bytes(4, 'big')
-        header += bytearray(0x180 - len(header))
-
-        return bytes(header)
+        return _LZSS_HEADER.pack(
+            _LZSS_MAGIC, adler32(self.data), self.size, comp_size, 1
+        ).ljust(0x180, b'\0')
 
     def _decompress_data(
         self, data: bytes, compression: Compression, size: Optional[int] = None
@@ -1179,25 +1344,24 @@ class IM4PData(_PyIMG4):
         if compression == Compression.LZSS:
             return lzss.decompress(data)
 
-        elif self.compression == Compression.LZFSE:
-            return _lzfse_decompress(self.data, size)
+        elif compression == Compression.LZFSE:
+            return _lzfse_decompress(data, size)
 
     def _detect_compression(self, size: int, data: bytes) -> None:
         if self.encrypted and size > 0:
             self._compression = Compression.LZFSE_ENCRYPTED
 
-        elif data.startswith(b'complzss'):
+        elif data.startswith(_LZSS_MAGIC):
             self._compression = Compression.LZSS
 
-        elif data.startswith(b'bvx') and b'bvx$' in self.data:
+        elif data.startswith(_LZFSE_MAGIC) and _has_lzfse_end(data):
             self._compression = Compression.LZFSE
 
         else:
             self._compression = Compression.NONE
 
     def _parse_complzss_header(self) -> None:
-        self.size = int(self.data[0xC:0x10].hex(), 16)
-        cmp_len = int(self.data[0x10:0x14].hex(), 16)
+        _, _, self.size, cmp_len, _ = _LZSS_HEADER.unpack_from(self.data)
 
         if (
             cmp_len < len(self.data) - 0x180
@@ -1217,7 +1381,7 @@ class IM4PData(_PyIMG4):
 
     @property
     def encrypted(self) -> bool:
-        return len(self.keybags) > 0
+        return len(self._keybags) > 0
 
     @property
     def extra(self) -> Optional[bytes]:
@@ -1258,21 +1422,21 @@ class IM4PData(_PyIMG4):
         if not isinstance(keybag, Keybag):
             raise UnexpectedDataError('Keybag', keybag)
 
-        if any(kbag.type == keybag.type for kbag in self.keybags):
+        # Only one keybag of each type can be added, so this also covers
+        # the keybag itself already being added. Keybag types can be changed
+        # after they're added, so always check the current ones.
+        if any(kbag.type == keybag.type for kbag in self._keybags):
             raise ValueError(
                 f'There is already a {keybag.type.name.lower()} keybag added.'
             )
 
-        if any(kbag == keybag for kbag in self.keybags):
-            raise ValueError('This keybag already exists.')
-
         self._keybags.append(keybag)
 
     def remove_keybag(
         self, keybag: Optional[Keybag] = None, type_: Optional[KeybagType] = None
     ) -> None:
         if keybag is not None:
-            if not isinstance(keybag, keybag):
+            if not isinstance(keybag, Keybag):
                 raise UnexpectedDataError('Keybag', keybag)
 
             if keybag not in self._keybags:
@@ -1281,14 +1445,12 @@ class IM4PData(_PyIMG4):
             self._keybags.remove(keybag)
 
         elif type_ is not None:
-            keybag = next(
-                (kbag for kbag in self.properties if kbag.type == type_), None
-            )
-            if keybag is not None:
-                self._keybags.remove(keybag)
-            else:
+            keybag = next((kbag for kbag in self._keybags if kbag.type == type_), None)
+            if keybag is None:
                 raise ValueError(f'There is no {type_.name.lower()} keybag added.')
 
+            self._keybags.remove(keybag)
+
     def compress(self, compression: Compression) -> None:
         if compression in (
             Compression.NONE,
@@ -1306,15 +1468,17 @@ class IM4PData(_PyIMG4):
         if compression == Compression.LZSS:
             comp_data = lzss.compress(self.data)
             self._data = self._create_complzss_header(len(comp_data)) + comp_data
+            self._compression = Compression.LZSS
 
         elif compression == Compression.LZFSE:
             comp_data = _lzfse_compress(self.data)
-            if not (comp_data.startswith(b'bvx2') and b'bvx$' in comp_data):
+            if not (
+                comp_data.startswith(_LZFSE_V2_MAGIC) and _has_lzfse_end(comp_data)
+            ):
                 raise CompressionError('Failed to LZFSE-compress payload.')
 
             self._data = comp_data
-
-        self._detect_compression(self.size, self.data)
+            self._compression = Compression.LZFSE
 
     def decompress(self) -> None:
         if self.compression == Compression.NONE:
@@ -1324,8 +1488,8 @@ class IM4PData(_PyIMG4):
             raise CompressionError('Cannot decompress encrypted payload.')
 
         self._data = self._decompress_data(self.data, self.compression, self.size)
+
         self._compression = Compression.NONE
-        self._detect_compression(self.size, self.data)
 
     def decrypt(self, kbag: Keybag) -> None:
         self._data = AES.new(kbag.key, AES.MODE_CBC, kbag.iv).decrypt(self.data)
@@ -1340,32 +1504,15 @@ class IM4PData(_PyIMG4):
     def output(self) -> Payload:
         kbag_data = None
         if self.encrypted:
-            self._encoder.start()
-            with self._encoder.construct(asn1.Numbers.Sequence, asn1.Classes.Universal):
-                for kbag in self.keybags:
-                    with self._encoder.construct(
-                        asn1.Numbers.Sequence, asn1.Classes.Universal
-                    ):
-                        self._encoder.write(
-                            self.keybags.index(kbag) + 1,
-                            asn1.Numbers.Integer,
-                            asn1.Types.Primitive,
-                            asn1.Classes.Universal,
-                        )
-                        self._encoder.write(
-                            kbag.iv,
-                            asn1.Numbers.OctetString,
-                            asn1.Types.Primitive,
-                            asn1.Classes.Universal,
-                        )
-                        self._encoder.write(
-                            kbag.key,
-                            asn1.Numbers.OctetString,
-                            asn1.Types.Primitive,
-                            asn1.Classes.Universal,
-                        )
+            encoder = self._encoder
+            write = encoder.write
 
-            kbag_data = self._encoder.output()
+            encoder.start()
+            with encoder.construct(_SEQUENCE, _UNIVERSAL):
+                for kbag in self._keybags:
+                    write(kbag.output(), _SEQUENCE, _CONSTRUCTED, _UNIVERSAL)
+
+            kbag_data = encoder.output()
 
         if self.extra is not None:
             data = self.data + self.extra
@@ -1373,3 +1520,6 @@ class IM4PData(_PyIMG4):
             data = self.data
 
         return Payload(data, kbag_data)
+
+
+_TYPES = {'IMG4': IMG4, 'IM4P': IM4P, 'IM4M': IM4M, 'IM4R': IM4R}
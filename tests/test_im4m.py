@@ -1,3 +1,5 @@
+import pytest
+
 import pyimg4
 
 
@@ -15,3 +17,44 @@ def test_im4m(IM4M: bytes) -> None:
 
     assert len(im4m.properties) == 11
     assert len(im4m.images) == 35
+
+
+def test_property() -> None:
+    prop = pyimg4.ManifestProperty(fourcc='EPRO', value=False)
+    assert prop.value is False
+
+    prop.output()
+
+
+def test_null_property() -> None:
+    image = pyimg4.ManifestImageProperties(
+        bytes.fromhex('30191604746573743111ff84aac1a44f0a300816044550524f0500')
+    )
+
+    assert len(image.properties) == 1
+    assert image.properties[0].value is None
+
+    prop = bytes.fromhex('ff84aac1a44f0a300816044550524f0500')
+    with pytest.raises(ValueError):
+        pyimg4.ManifestImageProperties(
+            bytes.fromhex('302a1604746573743122') + prop + prop
+        )
+
+
+def test_images(IM4M: bytes) -> None:
+    im4m = pyimg4.IM4M(IM4M)
+
+    image = im4m.images[0]
+    im4m.remove_image_properties(image)
+    assert len(im4m.images) == 34
+
+    with pytest.raises(ValueError):
+        im4m.remove_image_properties(fourcc=image.fourcc)
+
+    im4m.add_image_properties(image)
+    assert im4m.images[0] == image
+
+    assert im4m.get_image_properties(image.fourcc) == image
+    assert im4m.get_image_properties('none') is None
+
+    assert im4m.output() == IM4M
@@ -125,3 +125,61 @@ def test_read_payp(PAYP_IM4P: bytes) -> None:
     assert all(prop.fourcc in ('mmap', 'rddg') for prop in im4p.properties)
 
     im4p.output()
+
+
+def test_properties() -> None:
+    im4p = pyimg4.IM4P(fourcc='test', payload=b'Test payload.')
+
+    prop = pyimg4.PayloadProperty(fourcc='rddg', value=1)
+    im4p.add_property(prop)
+
+    with pytest.raises(ValueError):
+        im4p.add_property(prop)
+
+    im4p.remove_property(prop)
+    assert im4p.properties == ()
+
+
+def test_keybags() -> None:
+    payload = pyimg4.IM4PData(b'Test payload.')
+
+    kbag = pyimg4.Keybag(iv=bytes(16), key=bytes(32))
+    payload.add_keybag(kbag)
+
+    with pytest.raises(ValueError):
+        payload.add_keybag(kbag)
+
+    payload.add_keybag(
+        pyimg4.Keybag(iv=bytes(16), key=bytes(32), type_=pyimg4.KeybagType.DEVELOPMENT)
+    )
+    assert payload.encrypted is True
+    assert len(payload.keybags) == 2
+
+    payload.remove_keybag(pyimg4.Keybag(iv=bytes(16), key=bytes(32)))
+    payload.remove_keybag(type_=pyimg4.KeybagType.DEVELOPMENT)
+    assert payload.keybags == ()
+
+    with pytest.raises(ValueError):
+        payload.remove_keybag(type_=pyimg4.KeybagType.PRODUCTION)
+
+    payload.add_keybag(kbag)
+    kbag.type = pyimg4.KeybagType.DEVELOPMENT
+
+    with pytest.raises(ValueError):
+        payload.add_keybag(
+            pyimg4.Keybag(
+                iv=bytes(16), key=bytes(32), type_=pyimg4.KeybagType.DEVELOPMENT
+            )
+        )
+
+    payload.remove_keybag(kbag)
+    assert payload.keybags == ()
+
+
+def test_truncated() -> None:
+    for data in (b'\x30', b'\x30\x80', b'\x30\x06\x16\x04IM4P'):
+        with pytest.raises(ValueError):
+            pyimg4.IM4P(data)
+
+    with pytest.raises(ValueError):
+        pyimg4.Keybag(b'\x02\x01\x01\x04')
@@ -19,4 +19,6 @@ def test_read(IM4R: bytes) -> None:
 
     assert im4r.boot_nonce.hex() == '5f56bbaee8c2d27c'
 
-    im4r.output()
+    assert im4r.output() == IM4R
+    assert im4r.output() == IM4R
+    assert im4r.boot_nonce.hex() == '5f56bbaee8c2d27c'